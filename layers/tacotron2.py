@@ -1,8 +1,100 @@
+import contextlib
+from typing import Optional
+
 import torch
-from torch.autograd import Variable
 from torch import nn
 from torch.nn import functional as F
-from .common_layers import init_attn, Prenet, Linear
+from .common_layers import init_attn, GravesAttention, Prenet, Linear
+
+
+# Per-frame decoder kernels. Parameters are passed in explicitly so Decoder keeps
+# its submodules (and the checkpoint layout) while each cat -> cell -> dropout
+# chain runs as a single TorchScript call instead of a sequence of Python ops.
+# Dropout is branched on ``training`` so the eval path does not dispatch it at all.
+@torch.jit.script
+def lstm_cell(input_gates: torch.Tensor, hidden_gates: torch.Tensor,
+              cell_state: torch.Tensor):
+    """LSTMCell update from precomputed input and hidden gate pre-activations
+    (i, f, g, o), biases included. On CUDA the gate sum and the pointwise
+    update run as the single fused kernel nn.LSTMCell uses."""
+    if input_gates.is_cuda:
+        hidden, cell_state, _ = torch.ops.aten._thnn_fused_lstm_cell(
+            input_gates, hidden_gates, cell_state)
+        return hidden, cell_state
+    gates = input_gates + hidden_gates
+    ingate, forgetgate, cellgate, outgate = gates.chunk(4, 1)
+    cell_state = torch.sigmoid(forgetgate) * cell_state + torch.sigmoid(
+        ingate) * torch.tanh(cellgate)
+    hidden = torch.sigmoid(outgate) * torch.tanh(cell_state)
+    return hidden, cell_state
+
+
+@torch.jit.script
+def attention_rnn_step(memory_gates: torch.Tensor, context: torch.Tensor,
+                       query: torch.Tensor, cell_state: torch.Tensor,
+                       weight_context: torch.Tensor, weight_hh: torch.Tensor,
+                       bias_hh: torch.Tensor, p_dropout: float, training: bool):
+    # memory_gates hold the memory part of the input gates, bias_ih included
+    input_gates = torch.addmm(memory_gates, context, weight_context.t())
+    query, cell_state = lstm_cell(input_gates,
+                                  F.linear(query, weight_hh, bias_hh),
+                                  cell_state)
+    if training:
+        query = F.dropout(query, p_dropout, True)
+        cell_state = F.dropout(cell_state, p_dropout, True)
+    return query, cell_state
+
+
+@torch.jit.script
+def decoder_rnn_step(query: torch.Tensor, context: torch.Tensor,
+                     hidden: torch.Tensor, cell_state: torch.Tensor,
+                     weight_query: torch.Tensor, weight_context: torch.Tensor,
+                     weight_hh: torch.Tensor, bias_ih: torch.Tensor,
+                     bias_hh: torch.Tensor, p_dropout: float, training: bool):
+    # cat((query, context)) @ W.T == query @ W_query.T + context @ W_context.T
+    input_gates = torch.addmm(F.linear(query, weight_query, bias_ih), context,
+                              weight_context.t())
+    hidden, cell_state = lstm_cell(input_gates,
+                                   F.linear(hidden, weight_hh, bias_hh),
+                                   cell_state)
+    if training:
+        hidden = F.dropout(hidden, p_dropout, True)
+    return hidden, cell_state
+
+
+@torch.jit.script
+def decoder_output_step(hidden: torch.Tensor, context: torch.Tensor,
+                        proj_weight_hidden: torch.Tensor,
+                        proj_weight_context: torch.Tensor,
+                        proj_bias: torch.Tensor,
+                        stop_weight_hidden: torch.Tensor,
+                        stop_weight_output: torch.Tensor,
+                        stop_bias: torch.Tensor, p_stop_dropout: float,
+                        separate_stopnet: bool, training: bool):
+    # the projection and stopnet inputs are never concatenated, each part is
+    # multiplied by its weight columns and accumulated by addmm
+    decoder_output = torch.addmm(F.linear(hidden, proj_weight_hidden, proj_bias),
+                                 context, proj_weight_context.t())
+    stopnet_hidden, stopnet_output = hidden, decoder_output
+    if separate_stopnet:
+        stopnet_hidden = stopnet_hidden.detach()
+        stopnet_output = stopnet_output.detach()
+    if training:
+        stopnet_hidden = F.dropout(stopnet_hidden, p_stop_dropout, True)
+        stopnet_output = F.dropout(stopnet_output, p_stop_dropout, True)
+    stop_token = torch.addmm(
+        F.linear(stopnet_hidden, stop_weight_hidden, stop_bias),
+        stopnet_output, stop_weight_output.t())
+    return decoder_output, stop_token
+
+
+def inference_autocast(enabled):
+    """FP16 autocast context for CUDA inference, or a no-op context when
+    not enabled. FP16 is opt-in (``use_fp16`` of Encoder and Postnet) and
+    needs torch>=1.10."""
+    if not enabled:
+        return contextlib.nullcontext()
+    return torch.autocast('cuda', dtype=torch.float16)
 
 
 class ConvBNBlock(nn.Module):
@@ -23,6 +115,21 @@ class ConvBNBlock(nn.Module):
         else:
             self.activation = nn.Identity()
 
+    def fuse_bn(self):
+        """Fold the batch norm running statistics into the convolution
+        weights and drop the dropout layer. Only for inference, the block
+        can not be trained after fusing."""
+        if isinstance(self.batch_normalization, nn.Identity):
+            return
+        bn = self.batch_normalization
+        with torch.no_grad():
+            scale = bn.weight / torch.sqrt(bn.running_var + bn.eps)
+            self.convolution1d.weight.mul_(scale.view(-1, 1, 1))
+            self.convolution1d.bias.sub_(bn.running_mean).mul_(scale).add_(
+                bn.bias)
+        self.batch_normalization = nn.Identity()
+        self.dropout = nn.Identity()
+
     def forward(self, x):
         o = self.convolution1d(x)
         o = self.batch_normalization(o)
@@ -31,32 +138,122 @@ class ConvBNBlock(nn.Module):
         return o
 
 
+class SeparableConvBNBlock(ConvBNBlock):
+    """ConvBNBlock with a depthwise separable convolution, a depthwise
+    convolution followed by the pointwise ``convolution1d``. About
+    ``kernel_size`` times fewer multiply-adds, but not weight compatible
+    with ConvBNBlock and needs training from scratch."""
+    def __init__(self, in_channels, out_channels, kernel_size, activation=None):
+        super(SeparableConvBNBlock, self).__init__(in_channels, out_channels,
+                                                   kernel_size, activation)
+        padding = (kernel_size - 1) // 2
+        self.depthwise = nn.Conv1d(in_channels,
+                                   in_channels,
+                                   kernel_size,
+                                   padding=padding,
+                                   groups=in_channels,
+                                   bias=False)
+        self.convolution1d = nn.Conv1d(in_channels, out_channels, 1)
+
+    def forward(self, x):
+        return super(SeparableConvBNBlock, self).forward(self.depthwise(x))
+
+
+def channels_last_1d(x):
+    """Give a B x C x T CUDA tensor B x T x C (NWC) strides, so that cuDNN
+    picks its channels last convolution kernels. Free for inputs that are
+    transposed B x T x C tensors already, CPU tensors are returned
+    unchanged. Opt-in (``channels_last`` of Encoder and Postnet), it has not
+    been profiled against the default layout."""
+    if not x.is_cuda:
+        return x
+    return x.transpose(1, 2).contiguous().transpose(1, 2)
+
+
+def compile_conv_stack(convolutions):
+    """Compile a ``nn.Sequential`` of ConvBNBlocks so that the
+    BN/activation/dropout epilogues are fused into the convolution kernels.
+    The module is compiled in place (its forward on torch 2.0/2.1, which have
+    ``torch.compile`` but no ``Module.compile``), so parameter names and the
+    state dict are unchanged. Falls back to TorchScript before torch 2.0."""
+    if hasattr(convolutions, 'compile'):
+        convolutions.compile(mode="reduce-overhead", fullgraph=True)
+        return convolutions
+    if hasattr(torch, 'compile'):
+        convolutions.forward = torch.compile(convolutions.forward,
+                                             mode="reduce-overhead",
+                                             fullgraph=True)
+        return convolutions
+    return torch.jit.script(convolutions)
+
+
+class MaskedSequential(nn.Sequential):
+    """``nn.Sequential`` that zeroes the padded time steps after every block,
+    so a zero padded input gives the same outputs on the valid steps."""
+    def forward(self, x, mask: Optional[torch.Tensor] = None):
+        for module in self:
+            x = module(x)
+            if mask is not None:
+                x = x * mask
+        return x
+
+
+def bucket_length(x, buckets, channels_last=False):
+    """Zero pad the time axis of a B x C x T input to the smallest bucket
+    that fits it. Returns the padded input and its B x 1 x T' mask, or the
+    input and None if it is longer than every bucket. With
+    ``channels_last`` the padded input has the layout of channels_last_1d."""
+    length = x.size(2)
+    bucket = next((b for b in buckets if b >= length), None)
+    if bucket is None:
+        return (channels_last_1d(x) if channels_last else x), None
+    mask = x.new_zeros(1, 1, bucket)
+    mask[:, :, :length] = 1
+    if channels_last and x.is_cuda:
+        # pad the B x T x C view, F.pad returns B x C x T inputs contiguous
+        x = F.pad(x.transpose(1, 2), (0, 0, 0, bucket - length)).transpose(1, 2)
+    else:
+        x = F.pad(x, (0, bucket - length))
+    if hasattr(torch, '_dynamo'):
+        torch._dynamo.mark_static(x, 2)
+    return x, mask
+
+
 class Postnet(nn.Module):
-    def __init__(self, output_dim, num_convs=5):
+    def __init__(self, output_dim, num_convs=5, separable=False):
         super(Postnet, self).__init__()
-        self.convolutions = nn.ModuleList()
-        self.convolutions.append(
-            ConvBNBlock(output_dim, 512, kernel_size=5, activation='tanh'))
+        convolutions = [
+            ConvBNBlock(output_dim, 512, kernel_size=5, activation='tanh')
+        ]
+        # the inner 512 -> 512 blocks take most of the postnet compute
+        inner_block = SeparableConvBNBlock if separable else ConvBNBlock
         for _ in range(1, num_convs - 1):
-            self.convolutions.append(
-                ConvBNBlock(512, 512, kernel_size=5, activation='tanh'))
-        self.convolutions.append(
+            convolutions.append(
+                inner_block(512, 512, kernel_size=5, activation='tanh'))
+        convolutions.append(
             ConvBNBlock(512, output_dim, kernel_size=5, activation=None))
+        self.convolutions = nn.Sequential(*convolutions)
+        # run under FP16 autocast at CUDA inference, see inference_autocast
+        self.use_fp16 = False
+        # CUDA inputs in NWC layout, see channels_last_1d
+        self.channels_last = False
+
+    def compile_convolutions(self):
+        self.convolutions = compile_conv_stack(self.convolutions)
 
     def forward(self, x):
-        o = x
-        for layer in self.convolutions:
-            o = layer(o)
-        return o
+        if self.channels_last:
+            x = channels_last_1d(x)
+        return self.convolutions(x)
 
 
 class Encoder(nn.Module):
     def __init__(self, output_input_dim=512):
         super(Encoder, self).__init__()
-        self.convolutions = nn.ModuleList()
-        for _ in range(3):
-            self.convolutions.append(
-                ConvBNBlock(output_input_dim, output_input_dim, 5, 'relu'))
+        self.convolutions = MaskedSequential(*[
+            ConvBNBlock(output_input_dim, output_input_dim, 5, 'relu')
+            for _ in range(3)
+        ])
         self.lstm = nn.LSTM(output_input_dim,
                             int(output_input_dim / 2),
                             num_layers=1,
@@ -64,28 +261,190 @@ class Encoder(nn.Module):
                             bias=True,
                             bidirectional=True)
         self.rnn_state = None
+        # inference pads the input length up to one of these, set once the
+        # convolutions are compiled so every input reuses a few static graphs
+        self.length_buckets = None
+        # run inference under FP16 autocast on CUDA, see inference_autocast
+        self.use_fp16 = False
+        # CUDA inputs in NWC layout, see channels_last_1d
+        self.channels_last = False
+
+    def compile_convolutions(self, length_buckets=(64, 128, 256, 512)):
+        self.convolutions = compile_conv_stack(self.convolutions)
+        self.length_buckets = length_buckets
 
     def forward(self, x, input_lengths):
-        o = x
-        for layer in self.convolutions:
-            o = layer(o)
+        if self.channels_last:
+            x = channels_last_1d(x)
+        o = self.convolutions(x)
         o = o.transpose(1, 2)
+        self.lstm.flatten_parameters()
+        # packing reads the lengths on the host, copy them only once
+        input_lengths = input_lengths.cpu()
+        if bool((input_lengths == o.size(1)).all()):
+            # no padding in the batch, run the dense (faster) LSTM kernel
+            o, _ = self.lstm(o)
+            return o
         o = nn.utils.rnn.pack_padded_sequence(o,
                                               input_lengths,
                                               batch_first=True)
-        self.lstm.flatten_parameters()
         o, _ = self.lstm(o)
         o, _ = nn.utils.rnn.pad_packed_sequence(o, batch_first=True)
         return o
 
+    @torch.no_grad()
     def inference(self, x):
-        o = x
-        for layer in self.convolutions:
-            o = layer(o)
-        o = o.transpose(1, 2)
-        # self.lstm.flatten_parameters()
-        o, _ = self.lstm(o)
-        return o
+        # with use_fp16 the convolutions and the LSTM run on Tensor Cores,
+        # the outputs are cast back for the FP32 decoder
+        with inference_autocast(self.use_fp16 and x.is_cuda):
+            if self.length_buckets is not None:
+                length = x.size(2)
+                x, mask = bucket_length(x, self.length_buckets,
+                                        self.channels_last)
+                o = self.convolutions(x, mask)[:, :, :length]
+            else:
+                if self.channels_last:
+                    x = channels_last_1d(x)
+                o = self.convolutions(x)
+            o = o.transpose(1, 2)
+            # self.lstm.flatten_parameters()
+            o, _ = self.lstm(o)
+        return o.float()
+
+
+class DecodeStepGraph:
+    """Replays ``Decoder.decode`` from a captured CUDA graph.
+
+    A decoder step launches a dozen tiny kernels, so at inference the GPU
+    mostly waits on launches. The step is captured for the exact encoder
+    length (and batch size, r) of an inference call and replayed per frame.
+    Encoder outputs are not bucketed, so a graph is only reused by later
+    calls with the same number of input characters. Any other length drops
+    it and pays the warm-up steps and a new capture, which suits repeated
+    or fixed length inputs rather than free text. Decoder and attention states are copied into static
+    buffers the graph reads from, and written back after every replay so the
+    module attributes stay valid for the eager code path. The split weights
+    of ``Decoder._init_states`` are new tensors on every call, they are
+    copied into static buffers as well.
+    """
+    DECODER_STATES = ('query', 'attention_rnn_cell_state', 'decoder_hidden',
+                      'decoder_cell', 'context', 'inputs', 'processed_inputs')
+    DECODER_WEIGHTS = ('attention_rnn_weights', 'decoder_rnn_weights',
+                       'linear_projection_weights', 'stopnet_weights')
+
+    def __init__(self, decoder, memory, num_warmup=3):
+        self.decoder = decoder
+        self.key = self.get_key(decoder, memory)
+        self.inputs_shape = decoder.inputs.shape
+        self.static_memory = memory.clone()
+        self.static_states = {
+            key: getattr(*key).clone()
+            for key in self._state_keys()
+        }
+        self.static_weights = {
+            name: tuple(weight.clone() for weight in getattr(decoder, name))
+            for name in self.DECODER_WEIGHTS
+        }
+        self.load_states()
+
+        # warm up on a side stream (cuBLAS handles, TorchScript profiling)
+        # and roll back the states the warm-up steps advanced
+        stream = torch.cuda.Stream()
+        stream.wait_stream(torch.cuda.current_stream())
+        with torch.cuda.stream(stream):
+            snapshot = [state.clone() for state in self.static_states.values()]
+            for _ in range(num_warmup):
+                decoder.decode(self.static_memory)
+                self.load_states()
+            for state, value in zip(self.static_states.values(), snapshot):
+                state.copy_(value)
+        torch.cuda.current_stream().wait_stream(stream)
+
+        self.graph = torch.cuda.CUDAGraph()
+        with torch.cuda.graph(self.graph):
+            self.static_outputs = decoder.decode(self.static_memory)
+        self.output_states = {key: getattr(*key) for key in self.static_states}
+        self._bind_states()
+
+    @staticmethod
+    def get_key(decoder, memory):
+        return (decoder.r, memory.shape, memory.dtype, decoder.inputs.shape)
+
+    def _state_keys(self):
+        keys = [(self.decoder, name) for name in self.DECODER_STATES]
+        attention = self.decoder.attention
+        keys += [(attention, name) for name, value in vars(attention).items()
+                 if torch.is_tensor(value)]
+        return keys
+
+    def _bind_states(self):
+        for (owner, name), state in self.static_states.items():
+            setattr(owner, name, state)
+
+    def load_states(self):
+        """Copy the current decoder states and split weights into the static
+        graph buffers."""
+        for key, state in self.static_states.items():
+            value = getattr(*key)
+            if value is not state:
+                state.copy_(value)
+        self._bind_states()
+        for name, weights in self.static_weights.items():
+            values = getattr(self.decoder, name)
+            if values is not weights:
+                for weight, value in zip(weights, values):
+                    weight.copy_(value)
+                setattr(self.decoder, name, weights)
+
+    def __call__(self, memory):
+        self.static_memory.copy_(memory)
+        self.graph.replay()
+        for key, state in self.static_states.items():
+            output = self.output_states[key]
+            if output is not state:
+                state.copy_(output)
+        # graph outputs are overwritten by the next replay
+        return tuple(output.clone() for output in self.static_outputs)
+
+
+class FrameBuffer:
+    """Time-major buffer for decoder outputs of unknown length. Storage is
+    allocated in chunks of ``chunk_size`` frames and each frame is copied in
+    place, instead of keeping a list of per-frame tensors and stacking them."""
+    def __init__(self, chunk_size=256):
+        self.chunk_size = chunk_size
+        self.chunks = []
+        self.length = 0
+
+    def __len__(self):
+        return self.length
+
+    def append(self, frame):
+        idx = self.length % self.chunk_size
+        if idx == 0:
+            self.chunks.append(frame.new_empty((self.chunk_size, ) + frame.shape))
+        self.chunks[-1][idx].copy_(frame)
+        self.length += 1
+
+    def last(self, n):
+        """Return the last n frames, they may span any number of chunks."""
+        assert 0 <= n <= self.length
+        start = self.length - n
+        first = min(start // self.chunk_size, len(self.chunks) - 1)
+        start -= first * self.chunk_size
+        chunks = self.chunks[first:]
+        frames = chunks[0] if len(chunks) == 1 else torch.cat(chunks)
+        return frames[start:start + n]
+
+    def truncate(self, length):
+        self.length = min(length, self.length)
+        self.chunks = self.chunks[:(self.length - 1) // self.chunk_size + 1]
+
+    def get(self):
+        """Return the stored frames as a single T x ... tensor."""
+        if len(self.chunks) == 1:
+            return self.chunks[0][:self.length]
+        return torch.cat(self.chunks)[:self.length]
 
 
 # adapted from https://github.com/NVIDIA/tacotron2/
@@ -99,10 +458,12 @@ class Decoder(nn.Module):
         super(Decoder, self).__init__()
         self.frame_dim = frame_dim
         self.r_init = r
-        self.r = r
+        self.set_r(r)
         self.encoder_embedding_dim = input_dim
         self.separate_stopnet = separate_stopnet
         self.max_decoder_steps = 1000000
+        # frames decoded between two host side checks of the stop tokens
+        self.stop_check_interval = 8
         self.gate_threshold = 0.5
 
         # model dimensions
@@ -153,99 +514,159 @@ class Decoder(nn.Module):
                    bias=True,
                    init_gain='sigmoid'))
         self.memory_truncated = None
+        # replay inference steps from a CUDA graph, see DecodeStepGraph. A
+        # graph is captured per encoder length and only reused for that length
+        self.use_cuda_graph = False
+        self.decode_graph = None
 
     def set_r(self, new_r):
         self.r = new_r
+        # start of the last frame in a decoder output, 0 for r=1
+        self._update_slice_start = self.frame_dim * (new_r - 1)
 
     def get_go_frame(self, inputs):
         B = inputs.size(0)
-        memory = torch.zeros(1, device=inputs.device).repeat(B,
-                             self.frame_dim * self.r)
+        memory = inputs.new_zeros(B, self.frame_dim * self.r)
         return memory
 
     def _init_states(self, inputs, mask, keep_states=False):
         B = inputs.size(0)
         # T = inputs.size(1)
         if not keep_states:
-            self.query = torch.zeros(1, device=inputs.device).repeat(
-                B, self.query_dim)
-            self.attention_rnn_cell_state = torch.zeros(
-                1, device=inputs.device).repeat(B, self.query_dim)
-            self.decoder_hidden = torch.zeros(1, device=inputs.device).repeat(
-                B, self.decoder_rnn_dim)
-            self.decoder_cell = torch.zeros(1, device=inputs.device).repeat(
-                B, self.decoder_rnn_dim)
-            self.context = torch.zeros(1, device=inputs.device).repeat(
-                B, self.encoder_embedding_dim)
+            self.query = inputs.new_zeros(B, self.query_dim)
+            self.attention_rnn_cell_state = inputs.new_zeros(B, self.query_dim)
+            self.decoder_hidden = inputs.new_zeros(B, self.decoder_rnn_dim)
+            self.decoder_cell = inputs.new_zeros(B, self.decoder_rnn_dim)
+            self.context = inputs.new_zeros(B, self.encoder_embedding_dim)
         self.inputs = inputs
         self.processed_inputs = self.attention.preprocess_inputs(inputs)
         self.mask = mask
+        # the LSTMCell input weights split by input part, so that steps need
+        # no torch.cat of their inputs. Split once per call, slicing per step
+        # would backprop a full size weight gradient for every frame.
+        self.attention_rnn_weights = self._split_weight(
+            self.attention_rnn.weight_ih,
+            [self.prenet_dim, self.encoder_embedding_dim])
+        self.decoder_rnn_weights = self._split_weight(
+            self.decoder_rnn.weight_ih,
+            [self.query_dim, self.encoder_embedding_dim])
+        self.linear_projection_weights = self._split_weight(
+            self.linear_projection.linear_layer.weight,
+            [self.decoder_rnn_dim, self.encoder_embedding_dim])
+        self.stopnet_weights = self._split_weight(
+            self.stopnet[1].linear_layer.weight,
+            [self.decoder_rnn_dim, self.frame_dim * self.r_init])
+
+    @staticmethod
+    def _split_weight(weight, sizes):
+        """Split a weight by input columns. Column slices are strided and
+        make small batch GEMMs slower than the full weight, so without
+        autograd they are copied out once per call."""
+        weights = weight.split(sizes, dim=1)
+        if torch.is_grad_enabled():
+            return weights
+        return tuple(weight.contiguous() for weight in weights)
 
     def _reshape_memory(self, memory):
         """
         Reshape the spectrograms for given 'r'
         """
         # Grouping multiple frames if necessary
-        if memory.size(-1) == self.frame_dim:
+        if self.r > 1 and memory.size(-1) == self.frame_dim:
             memory = memory.view(memory.shape[0], memory.size(1) // self.r, -1)
         # Time first (T_decoder, B, frame_dim)
         memory = memory.transpose(0, 1)
         return memory
 
     def _parse_outputs(self, outputs, stop_tokens, alignments):
-        alignments = torch.stack(alignments).transpose(0, 1)
-        stop_tokens = torch.stack(stop_tokens).transpose(0, 1)
-        outputs = torch.stack(outputs).transpose(0, 1).contiguous()
+        """
+        shapes:
+            - outputs: T_decoder x B x (r * self.frame_dim)
+            - stop_tokens: T_decoder x B x ...
+            - alignments: T_decoder x B x T_en
+        """
+        alignments = alignments.transpose(0, 1)
+        stop_tokens = stop_tokens.transpose(0, 1)
+        outputs = outputs.transpose(0, 1).contiguous()
         outputs = outputs.view(outputs.size(0), -1, self.frame_dim)
         outputs = outputs.transpose(1, 2)
         return outputs, stop_tokens, alignments
 
     def _update_memory(self, memory):
-        if len(memory.shape) == 2:
-            return memory[:, self.frame_dim * (self.r - 1):]
-        return memory[:, :, self.frame_dim * (self.r - 1):]
-
-    def decode(self, memory):
+        if self._update_slice_start == 0:
+            return memory
+        return memory[..., self._update_slice_start:]
+
+    def _attention_rnn_memory_gates(self, memory):
+        """Input gates of the attention RNN for the memory part of its input.
+        Computed for all frames at once when the memories are known."""
+        return F.linear(memory, self.attention_rnn_weights[0],
+                        self.attention_rnn.bias_ih)
+
+    def _decoder_output(self, decoder_hidden, context):
+        stopnet_dropout, stopnet_linear = self.stopnet[0], self.stopnet[1].linear_layer
+        return decoder_output_step(
+            decoder_hidden, context, self.linear_projection_weights[0],
+            self.linear_projection_weights[1],
+            self.linear_projection.linear_layer.bias, self.stopnet_weights[0],
+            self.stopnet_weights[1], stopnet_linear.bias, stopnet_dropout.p,
+            self.separate_stopnet, self.training)
+
+    def decode(self, memory, memory_gates=None):
         '''
          shapes:
             - memory: B x r * self.frame_dim
+            - memory_gates: B x 4 * D_attn_rnn, precomputed attention RNN
+              input gates of memory (optional)
         '''
-        # self.context: B x D_en
-        # query_input: B x D_en + (r * self.frame_dim)
-        query_input = torch.cat((memory, self.context), -1)
+        if memory_gates is None:
+            memory_gates = self._attention_rnn_memory_gates(memory)
         # self.query and self.attention_rnn_cell_state : B x D_attn_rnn
-        self.query, self.attention_rnn_cell_state = self.attention_rnn(
-            query_input, (self.query, self.attention_rnn_cell_state))
-        self.query = F.dropout(self.query, self.p_attention_dropout,
-                               self.training)
-        self.attention_rnn_cell_state = F.dropout(
-            self.attention_rnn_cell_state, self.p_attention_dropout,
-            self.training)
+        self.query, self.attention_rnn_cell_state = attention_rnn_step(
+            memory_gates, self.context, self.query,
+            self.attention_rnn_cell_state, self.attention_rnn_weights[1],
+            self.attention_rnn.weight_hh, self.attention_rnn.bias_hh,
+            self.p_attention_dropout, self.training)
         # B x D_en
         self.context = self.attention(self.query, self.inputs,
                                       self.processed_inputs, self.mask)
-        # B x (D_en + D_attn_rnn)
-        decoder_rnn_input = torch.cat((self.query, self.context), -1)
         # self.decoder_hidden and self.decoder_cell: B x D_decoder_rnn
-        self.decoder_hidden, self.decoder_cell = self.decoder_rnn(
-            decoder_rnn_input, (self.decoder_hidden, self.decoder_cell))
-        self.decoder_hidden = F.dropout(self.decoder_hidden,
-                                        self.p_decoder_dropout, self.training)
-        # B x (D_decoder_rnn + D_en)
-        decoder_hidden_context = torch.cat((self.decoder_hidden, self.context),
-                                           dim=1)
-        # B x (self.r * self.frame_dim)
-        decoder_output = self.linear_projection(decoder_hidden_context)
-        # B x (D_decoder_rnn + (self.r * self.frame_dim))
-        stopnet_input = torch.cat((self.decoder_hidden, decoder_output), dim=1)
-        if self.separate_stopnet:
-            stop_token = self.stopnet(stopnet_input.detach())
-        else:
-            stop_token = self.stopnet(stopnet_input)
+        self.decoder_hidden, self.decoder_cell = decoder_rnn_step(
+            self.query, self.context, self.decoder_hidden, self.decoder_cell,
+            self.decoder_rnn_weights[0], self.decoder_rnn_weights[1],
+            self.decoder_rnn.weight_hh, self.decoder_rnn.bias_ih,
+            self.decoder_rnn.bias_hh, self.p_decoder_dropout, self.training)
+        # B x (self.r * self.frame_dim) -- B x 1
+        decoder_output, stop_token = self._decoder_output(
+            self.decoder_hidden, self.context)
         # select outputs for the reduction rate self.r
         decoder_output = decoder_output[:, :self.r * self.frame_dim]
         return decoder_output, self.attention.attention_weights, stop_token
 
+    def _get_decode_fn(self, inputs):
+        """Return the step function for inference, CUDA graph replay if
+        enabled. Windowing, the forward attention mask and Graves attention
+        read values back to the host within a step and cannot be captured."""
+        attention = self.attention
+        if (not self.use_cuda_graph or not inputs.is_cuda or self.training
+                or isinstance(attention, GravesAttention)
+                or attention.windowing or attention.forward_attn_mask):
+            return self.decode
+
+        def decode_fn(memory):
+            key = DecodeStepGraph.get_key(self, memory)
+            if self.decode_graph is None or self.decode_graph.key != key:
+                self.decode_graph = DecodeStepGraph(self, memory)
+            return self.decode_graph(memory)
+
+        if self.decode_graph is not None:
+            if self.decode_graph.inputs_shape == inputs.shape:
+                self.decode_graph.load_states()
+            else:
+                # release the memory pool of the stale graph
+                self.decode_graph = None
+        return decode_fn
+
     def forward(self, inputs, memories, mask, speaker_embeddings=None):
         memory = self.get_go_frame(inputs).unsqueeze(0)
         memories = self._reshape_memory(memories)
@@ -257,51 +678,81 @@ class Decoder(nn.Module):
 
         self._init_states(inputs, mask=mask)
         self.attention.init_states(inputs)
+        # one GEMM over all frames instead of one per decoder step
+        memories_gates = self._attention_rnn_memory_gates(memories)
 
         outputs, stop_tokens, alignments = [], [], []
-        while len(outputs) < memories.size(0) - 1:
-            memory = memories[len(outputs)]
-            decoder_output, attention_weights, stop_token = self.decode(memory)
+        # the last frame is only a decoder target, never an input
+        for memory, memory_gates in zip(memories.unbind(0)[:-1],
+                                        memories_gates.unbind(0)[:-1]):
+            decoder_output, attention_weights, stop_token = self.decode(
+                memory, memory_gates)
             outputs += [decoder_output.squeeze(1)]
             stop_tokens += [stop_token.squeeze(1)]
             alignments += [attention_weights]
 
+        # frames are kept in lists while training, stacking is cheap to
+        # backprop through whereas in-place writes into a buffer are not
         outputs, stop_tokens, alignments = self._parse_outputs(
-            outputs, stop_tokens, alignments)
+            torch.stack(outputs), torch.stack(stop_tokens),
+            torch.stack(alignments))
         return outputs, alignments, stop_tokens
 
+    @staticmethod
+    def _find_stop_frame(stop_tokens, start, min_frame):
+        """Return the index of the first frame from ``start`` on whose stop
+        token passes the threshold after ``min_frame``, or None."""
+        window = stop_tokens.last(len(stop_tokens) - start)
+        hits = (window > 0.7).view(window.size(0), -1).all(1).tolist()
+        for idx, hit in enumerate(hits, start):
+            if hit and idx > min_frame:
+                return idx
+        return None
+
+    @torch.no_grad()
     def inference(self, inputs, speaker_embeddings=None):
         memory = self.get_go_frame(inputs)
         memory = self._update_memory(memory)
 
         self._init_states(inputs, mask=None)
         self.attention.init_states(inputs)
+        decode = self._get_decode_fn(inputs)
 
-        outputs, stop_tokens, alignments, t = [], [], [], 0
+        outputs, stop_tokens, alignments = FrameBuffer(), FrameBuffer(), FrameBuffer()
+        num_checked = 0
         while True:
             memory = self.prenet(memory)
             if speaker_embeddings is not None:
                 memory = torch.cat([memory, speaker_embeddings], dim=-1)
-            decoder_output, alignment, stop_token = self.decode(memory)
-            stop_token = torch.sigmoid(stop_token.data)
-            outputs += [decoder_output.squeeze(1)]
-            stop_tokens += [stop_token]
-            alignments += [alignment]
-
-            if stop_token > 0.7 and t > inputs.shape[0] / 2:
-                break
-            if len(outputs) == self.max_decoder_steps:
-                print("   | > Decoder stopped with 'max_decoder_steps")
-                break
+            decoder_output, alignment, stop_token = decode(memory)
+            stop_token = torch.sigmoid(stop_token.detach())
+            outputs.append(decoder_output)
+            stop_tokens.append(stop_token)
+            alignments.append(alignment)
+
+            # reading the stop tokens syncs with the device, so they are
+            # checked every few frames and the overshoot is cut off
+            if (len(outputs) % self.stop_check_interval == 0
+                    or len(outputs) == self.max_decoder_steps):
+                stop_idx = self._find_stop_frame(stop_tokens, num_checked,
+                                                 inputs.shape[0] / 2)
+                num_checked = len(outputs)
+                if stop_idx is not None:
+                    for buffer in (outputs, stop_tokens, alignments):
+                        buffer.truncate(stop_idx + 1)
+                    break
+                if len(outputs) == self.max_decoder_steps:
+                    print("   | > Decoder stopped with 'max_decoder_steps")
+                    break
 
             memory = self._update_memory(decoder_output)
-            t += 1
 
         outputs, stop_tokens, alignments = self._parse_outputs(
-            outputs, stop_tokens, alignments)
+            outputs.get(), stop_tokens.get(), alignments.get())
 
         return outputs, alignments, stop_tokens
 
+    @torch.no_grad()
     def inference_truncated(self, inputs):
         """
         Preserve decoder states for continuous inference
@@ -314,15 +765,14 @@ class Decoder(nn.Module):
 
         self.attention.init_win_idx()
         self.attention.init_states(inputs)
-        outputs, stop_tokens, alignments, t = [], [], [], 0
-        stop_flags = [True, False, False]
+        outputs, stop_tokens, alignments = FrameBuffer(), FrameBuffer(), FrameBuffer()
         while True:
             memory = self.prenet(self.memory_truncated)
             decoder_output, alignment, stop_token = self.decode(memory)
-            stop_token = torch.sigmoid(stop_token.data)
-            outputs += [decoder_output.squeeze(1)]
-            stop_tokens += [stop_token]
-            alignments += [alignment]
+            stop_token = torch.sigmoid(stop_token.detach())
+            outputs.append(decoder_output)
+            stop_tokens.append(stop_token)
+            alignments.append(alignment)
 
             if stop_token > 0.7:
                 break
@@ -331,10 +781,9 @@ class Decoder(nn.Module):
                 break
 
             self.memory_truncated = decoder_output
-            t += 1
 
         outputs, stop_tokens, alignments = self._parse_outputs(
-            outputs, stop_tokens, alignments)
+            outputs.get(), stop_tokens.get(), alignments.get())
 
         return outputs, alignments, stop_tokens
 
@@ -348,6 +797,6 @@ class Decoder(nn.Module):
 
         memory = self.prenet(memory)
         decoder_output, stop_token, alignment = self.decode(memory)
-        stop_token = torch.sigmoid(stop_token.data)
+        stop_token = torch.sigmoid(stop_token.detach())
         memory = decoder_output
         return decoder_output, stop_token, alignment
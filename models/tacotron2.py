@@ -4,7 +4,7 @@ import torch
 from torch import nn
 
 from TTS.layers.gst_layers import GST
-from TTS.layers.tacotron2 import Decoder, Encoder, Postnet
+from TTS.layers.tacotron2 import Decoder, Encoder, Postnet, inference_autocast
 from TTS.models.tacotron_abstract import TacotronAbstract
 
 
@@ -30,7 +30,8 @@ class Tacotron2(TacotronAbstract):
                  bidirectional_decoder=False,
                  double_decoder_consistency=False,
                  ddc_r=None,
-                 gst=False):
+                 gst=False,
+                 separable_postnet=False):
         super(Tacotron2,
               self).__init__(num_chars, num_speakers, r, postnet_output_dim,
                              decoder_output_dim, attn_type, attn_win,
@@ -52,7 +53,8 @@ class Tacotron2(TacotronAbstract):
                                attn_norm, prenet_type, prenet_dropout,
                                forward_attn, trans_agent, forward_attn_mask,
                                location_attn, attn_K, separate_stopnet, proj_speaker_dim)
-        self.postnet = Postnet(self.postnet_output_dim)
+        self.postnet = Postnet(self.postnet_output_dim,
+                               separable=separable_postnet)
         # global style token layers
         if self.gst:
             gst_embedding_dim = encoder_in_features
@@ -133,12 +135,23 @@ class Tacotron2(TacotronAbstract):
                                                           self.speaker_embeddings)
         decoder_outputs, alignments, stop_tokens = self.decoder.inference(
             encoder_outputs)
-        postnet_outputs = self.postnet(decoder_outputs)
+        with inference_autocast(self.postnet.use_fp16
+                                and decoder_outputs.is_cuda):
+            postnet_outputs = self.postnet(decoder_outputs)
         postnet_outputs = decoder_outputs + postnet_outputs
         decoder_outputs, postnet_outputs, alignments = self.shape_outputs(
             decoder_outputs, postnet_outputs, alignments)
         return decoder_outputs, postnet_outputs, alignments, stop_tokens
 
+    def fuse_for_inference(self):
+        """Fold the batch norm layers of the encoder and postnet conv stacks
+        into their convolutions. The model is put in eval mode and can not
+        be trained afterwards. Call it before compiling the conv stacks."""
+        self.eval()
+        for layer in list(self.encoder.convolutions) + list(
+                self.postnet.convolutions):
+            layer.fuse_bn()
+
     def inference_truncated(self, text, speaker_ids=None):
         """
         Preserve model states for continuous inference
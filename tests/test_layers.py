@@ -2,6 +2,7 @@ import unittest
 import torch as T
 
 from TTS.layers.tacotron import Prenet, CBHG, Decoder, Encoder
+from TTS.layers.tacotron2 import Decoder as Tacotron2Decoder, Encoder as Tacotron2Encoder, Postnet as Tacotron2Postnet, FrameBuffer
 from TTS.layers.losses import L1LossMasked
 from TTS.utils.generic_utils import sequence_mask
 
@@ -116,6 +117,117 @@ class EncoderTests(unittest.TestCase):
         assert output.shape[2] == 256  # 128 * 2 BiRNN
 
 
+class Tacotron2EncoderTests(unittest.TestCase):
+    def test_length_buckets(self):
+        layer = Tacotron2Encoder(64)
+        # give the batch norm layers non-trivial statistics
+        layer.train()
+        layer(T.rand(4, 64, 30), T.full((4, ), 30))
+        layer.eval()
+        # padded to a bucket, exactly a bucket and longer than every bucket
+        for length in (10, 64, 77, 600):
+            dummy_input = T.rand(1, 64, length)
+            layer.length_buckets = None
+            output = layer.inference(dummy_input)
+            layer.length_buckets = (64, 128, 256, 512)
+            output_bucketed = layer.inference(dummy_input)
+            assert output_bucketed.shape == (1, length, 64)
+            assert T.allclose(output, output_bucketed, atol=1e-5)
+
+    def test_length_buckets_scripted(self):
+        layer = Tacotron2Encoder(64).eval()
+        convolutions = layer.convolutions
+        layer.convolutions = T.jit.script(convolutions)
+        layer.length_buckets = (64, 128)
+        # masked within the buckets, unmasked past them
+        for length in (10, 200):
+            dummy_input = T.rand(1, 64, length)
+            output = layer.inference(dummy_input)
+            with T.no_grad():
+                output_eager = layer.lstm(convolutions(dummy_input).transpose(1, 2))[0]
+            assert T.allclose(output, output_eager, atol=1e-5)
+
+    @unittest.skipIf(not T.cuda.is_available(), "channels last is CUDA only")
+    def test_channels_last(self):
+        layer = Tacotron2Encoder(64).cuda().eval()
+        layer.length_buckets = (64, 128)
+        for length in (10, 77, 200):
+            dummy_input = T.rand(1, 64, length).cuda()
+            output = layer.inference(dummy_input)
+            layer.channels_last = True
+            output_channels_last = layer.inference(dummy_input)
+            layer.channels_last = False
+            assert T.allclose(output, output_channels_last, atol=1e-3)
+
+
+class CompileConvStackTests(unittest.TestCase):
+    def test_compile_and_script(self):
+        for layer, channels in ((Tacotron2Encoder(64), 64),
+                                (Tacotron2Postnet(80), 80)):
+            layer.eval()
+            dummy_input = T.rand(1, channels, 30)
+            state_dict_keys = list(layer.state_dict().keys())
+            with T.no_grad():
+                output = layer.convolutions(dummy_input)
+                output_scripted = T.jit.script(layer.convolutions)(dummy_input)
+                layer.compile_convolutions()
+                output_compiled = layer.convolutions(dummy_input)
+            assert T.allclose(output, output_scripted, atol=1e-5)
+            assert T.allclose(output, output_compiled, atol=1e-4)
+            assert list(layer.state_dict().keys()) == state_dict_keys
+
+
+class FrameBufferTests(unittest.TestCase):
+    @staticmethod
+    def _fill(frames, chunk_size=4):
+        buffer = FrameBuffer(chunk_size)
+        for frame in frames:
+            buffer.append(frame)
+        return buffer
+
+    def test_append(self):
+        frames = T.rand(11, 2, 3)
+        for num_frames in (1, 4, 5, 8, 11):
+            buffer = self._fill(frames[:num_frames])
+            assert len(buffer) == num_frames
+            assert T.equal(buffer.get(), frames[:num_frames])
+
+    def test_last(self):
+        frames = T.rand(11, 2, 3)
+        # windows within the last chunk and across one or more chunk borders
+        for num_frames in (4, 5, 8, 11):
+            buffer = self._fill(frames[:num_frames])
+            for n in range(num_frames + 1):
+                assert T.equal(buffer.last(n),
+                               frames[num_frames - n:num_frames])
+
+    def test_truncate(self):
+        frames = T.rand(11, 2, 3)
+        for length in (1, 3, 4, 5, 8, 11, 20):
+            buffer = self._fill(frames)
+            buffer.truncate(length)
+            assert len(buffer) == min(length, 11)
+            assert T.equal(buffer.get(), frames[:length])
+            assert T.equal(buffer.last(1), frames[min(length, 11) - 1:][:1])
+            # appending continues right after the cut, also at chunk borders
+            buffer.append(frames[0])
+            assert T.equal(buffer.get(),
+                           T.cat([frames[:length], frames[:1]]))
+
+    def test_find_stop_frame(self):
+        stop_tokens = self._fill(T.tensor([[0.9], [0.1], [0.8], [0.2], [0.1],
+                                           [0.75], [0.9]]))
+        find_stop_frame = Tacotron2Decoder._find_stop_frame
+        assert find_stop_frame(stop_tokens, 0, -1) == 0
+        assert find_stop_frame(stop_tokens, 0, 0.5) == 2
+        assert find_stop_frame(stop_tokens, 3, 0.5) == 5
+        assert find_stop_frame(stop_tokens, 3, 5) == 6
+        assert find_stop_frame(stop_tokens, 0, 6) is None
+        # a window spanning more than two chunks
+        stop_tokens = self._fill(T.tensor([[0.1], [0.9]] + [[0.1]] * 8))
+        assert find_stop_frame(stop_tokens, 0, 0.5) == 1
+
+
 class L1LossMaskedTests(unittest.TestCase):
     def test_in_out(self):
         # test input == target
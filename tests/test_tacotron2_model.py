@@ -70,3 +70,126 @@ class TacotronTrainTest(unittest.TestCase):
             ), "param {} with shape {} not updated!! \n{}\n{}".format(
                 count, param.shape, param, param_ref)
             count += 1
+
+
+class TacotronInferenceTest(unittest.TestCase):
+    def test_fuse_for_inference(self):
+        input = torch.randint(1, 24, (1, 32)).long().to(device)
+        model = Tacotron2(num_chars=24, r=c.r, num_speakers=1).to(device)
+        model.decoder.max_decoder_steps = 20
+        # give the batch norm layers non-trivial statistics
+        model.train()
+        with torch.no_grad():
+            model.postnet(torch.rand(8, 80, 30).to(device))
+            model.encoder.inference(torch.rand(8, 512, 30).to(device))
+        model.eval()
+        with torch.no_grad():
+            outputs = model.inference(input)
+            model.fuse_for_inference()
+            outputs_fused = model.inference(input)
+            # fusing again is a no-op
+            model.fuse_for_inference()
+            outputs_fused_twice = model.inference(input)
+        for output, output_fused, output_fused_twice in zip(
+                outputs, outputs_fused, outputs_fused_twice):
+            assert output.shape == output_fused.shape
+            assert torch.equal(output_fused, output_fused_twice)
+            assert torch.allclose(output, output_fused, atol=1e-5), (
+                output - output_fused).abs().max()
+
+    def test_stop_check_interval(self):
+        input = torch.randint(1, 24, (1, 32)).long().to(device)
+        model = Tacotron2(num_chars=24, r=c.r, num_speakers=1).to(device)
+        model.eval()
+        # max_decoder_steps is not a multiple of the check interval
+        model.decoder.max_decoder_steps = 21
+        decoder_output_fn = model.decoder._decoder_output
+
+        def stop_from(stop_step):
+            """Override the stop tokens to pass the threshold from the given
+            decoder step on."""
+            steps = []
+
+            def _decoder_output(decoder_hidden, context):
+                decoder_output, stop_token = decoder_output_fn(
+                    decoder_hidden, context)
+                stop = 10. if len(steps) >= stop_step else -10.
+                steps.append(stop)
+                return decoder_output, torch.full_like(stop_token, stop)
+            return _decoder_output
+
+        # within and at the end of a check window, past max_decoder_steps
+        for stop_step in (1, 5, 7, 8, 13, 20, 30):
+            outputs = []
+            for stop_check_interval in (1, 8):
+                model.decoder.stop_check_interval = stop_check_interval
+                model.decoder._decoder_output = stop_from(stop_step)
+                with torch.no_grad():
+                    outputs.append(model.inference(input))
+            assert outputs[0][0].shape[1] == min(stop_step + 1, 21) * c.r
+            for output, output_batched in zip(*outputs):
+                assert output.shape == output_batched.shape
+                assert torch.allclose(output, output_batched)
+
+    @unittest.skipIf(not use_cuda, "CUDA graphs need a GPU")
+    def test_cuda_graph_inference(self):
+        model = Tacotron2(num_chars=24, r=c.r, num_speakers=1).to(device)
+        model.decoder.max_decoder_steps = 20
+        model.eval()
+        # repeated and changing input lengths, graphs are reused and recaptured
+        inputs = [torch.randint(1, 24, (1, num_chars)).long().to(device)
+                  for num_chars in (32, 32, 17, 32, 17)]
+        with torch.no_grad():
+            outputs = [model.inference(input) for input in inputs]
+            model.decoder.use_cuda_graph = True
+            outputs_graph = [model.inference(input) for input in inputs]
+        assert model.decoder.decode_graph is not None
+        for output, output_graph in zip(outputs, outputs_graph):
+            for tensor, tensor_graph in zip(output, output_graph):
+                assert tensor.shape == tensor_graph.shape
+                assert torch.allclose(tensor, tensor_graph, atol=1e-4), (
+                    tensor - tensor_graph).abs().max()
+
+    @unittest.skipIf(not use_cuda, "FP16 inference runs on CUDA only")
+    def test_fp16_inference(self):
+        input = torch.randint(1, 24, (1, 32)).long().to(device)
+        model = Tacotron2(num_chars=24, r=c.r, num_speakers=1).to(device)
+        model.decoder.max_decoder_steps = 20
+        model.eval()
+        with torch.no_grad():
+            # decode all 20 steps, a stop token close to the threshold could
+            # otherwise stop at different frames in FP16 and FP32
+            model.decoder.stopnet[1].linear_layer.bias.fill_(-100.)
+            outputs = model.inference(input)
+        # the flags work on their own and together
+        for fp16_modules in ((model.encoder, ), (model.postnet, ),
+                             (model.encoder, model.postnet)):
+            for module in fp16_modules:
+                module.use_fp16 = True
+            with torch.no_grad():
+                outputs_fp16 = model.inference(input)
+            for module in fp16_modules:
+                module.use_fp16 = False
+            for output, output_fp16 in zip(outputs, outputs_fp16):
+                assert output_fp16.dtype == torch.float32
+                assert output.shape == output_fp16.shape
+                assert torch.allclose(output, output_fp16, atol=1e-2), (
+                    output - output_fp16).abs().max()
+
+    def test_separable_postnet(self):
+        input = torch.randint(1, 24, (1, 32)).long().to(device)
+        model = Tacotron2(num_chars=24, r=c.r, num_speakers=1,
+                          separable_postnet=True).to(device)
+        model.decoder.max_decoder_steps = 20
+        model.train()
+        with torch.no_grad():
+            model.postnet(torch.rand(8, 80, 30).to(device))
+        model.eval()
+        with torch.no_grad():
+            outputs = model.inference(input)
+            model.fuse_for_inference()
+            outputs_fused = model.inference(input)
+        assert outputs[1].shape[2] == 80
+        for output, output_fused in zip(outputs, outputs_fused):
+            assert torch.allclose(output, output_fused, atol=1e-5), (
+                output - output_fused).abs().max()
@@ -184,7 +184,8 @@ def setup_model(num_chars, num_speakers, c):
                         separate_stopnet=c.separate_stopnet,
                         bidirectional_decoder=c.bidirectional_decoder,
                         double_decoder_consistency=c.double_decoder_consistency,
-                        ddc_r=c.ddc_r)
+                        ddc_r=c.ddc_r,
+                        separable_postnet=c.get('separable_postnet', False))
     return model
 
 class KeepAverage():
@@ -327,6 +328,9 @@ def check_config(c):
     _check_argument('stopnet', c, restricted=True, val_type=bool)
     _check_argument('separate_stopnet', c, restricted=True, val_type=bool)
 
+    # postnet
+    _check_argument('separable_postnet', c, val_type=bool)
+
     # tensorboard
     _check_argument('print_step', c, restricted=True, val_type=int, min_val=1)
     _check_argument('tb_plot_step', c, restricted=True, val_type=int, min_val=1)